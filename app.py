@@ -1,163 +1,152 @@
 import os
+import logging
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
 import torch
 import gradio as gr
-import matplotlib.pyplot as plt
-import numpy as np
-from scipy.ndimage import gaussian_filter1d
-from emotion_agent import analyze_call
-import io
-from PIL import Image  # Already available in Gradio environments
-
-def fig_to_image(fig):
-    """Convert Matplotlib figure to a PIL image."""
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    return Image.open(buf)
+from batch_worker import MAX_BATCH_FILES, analyze_files
+from emotion_agent import ANALYSIS_VERSION, LABEL_ORDER
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
 
 # Use CPU
 os.environ['PYTORCH_ENABLE_MPS_FALLBACK'] = '1'
 device = torch.device('cpu')
-print(f"Device set to use {device}")
-
-def run_live_analysis(audio_file):
-    print("\n🎧 Starting analysis...")
-    result = analyze_call(audio_file)
-
-    if result is None or len(result) != 3:
-        return "❌ Analysis failed - Please try again with a valid audio file", None, None, "No transcription available."
-
-    emotion_history, final_percentages, full_transcript = result
-
-    # Timing Analysis
-    total_segments = len(emotion_history)
-    segment_duration = 30  # seconds
-    total_duration = total_segments * segment_duration
-    timing_info = f"📊 Analysis completed in {total_segments} segments over {total_duration//60}m {total_duration%60}s"
-
-    # Enhanced Bar chart for emotion percentages
-    plt.style.use('default')
-    bar_fig, bar_ax = plt.subplots(figsize=(12, 6))
-    bar_fig.patch.set_facecolor('#ffffff')
-    
-    emotions = list(final_percentages.keys())
-    values = list(final_percentages.values())
-    
-    # Professional color palette - ensure enough colors
-    colors = ['#6366f1', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981', '#ef4444', '#06b6d4', '#84cc16']
-    # Extend colors if we have more emotions than colors  
-    while len(colors) < len(emotions):
-        colors.extend(colors)
-
-    bar_colors = [colors[i % len(colors)] for i in range(len(emotions))]
-    
-    bars = bar_ax.barh(emotions, values, color=bar_colors, height=0.6)
-    
-    # Add value labels with better formatting
-    for i, bar in enumerate(bars):
-        width = bar.get_width()
-        bar_ax.text(
-            width + 0.5, bar.get_y() + bar.get_height() / 2,
-            f"{width:.1f}%", 
-            va='center', 
-            ha='left',
-            fontsize=11,
-            fontweight='600',
-            color='#374151'
-        )
-    
-    bar_ax.set_xlim([0, max(values) + 8])
-    bar_ax.set_title("Emotion Analysis Results", fontsize=16, fontweight='bold', color='#1f2937', pad=20)
-    bar_ax.set_xlabel("Percentage (%)", fontsize=12, color='#6b7280')
-    bar_ax.invert_yaxis()
-    
-    # Enhanced styling
-    bar_ax.spines['top'].set_visible(False)
-    bar_ax.spines['right'].set_visible(False)
-    bar_ax.spines['left'].set_color('#e5e7eb')
-    bar_ax.spines['bottom'].set_color('#e5e7eb')
-    bar_ax.grid(True, linestyle='-', alpha=0.1, axis='x')
-    bar_ax.tick_params(colors='#6b7280', labelsize=10)
-    
-    bar_fig.tight_layout()
-
-    # Enhanced Line chart for emotion trends with smoothing
-    line_fig, ax = plt.subplots(figsize=(12, 6))
-    line_fig.patch.set_facecolor('#ffffff')
-
-    # Ensure we have enough colors for all emotions
-    colors = ['#6366f1', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981', '#ef4444', '#06b6d4', '#84cc16']
-    # Extend colors if we have more emotions than colors
-    while len(colors) < len(emotions):
-        colors.extend(colors)
-
-    for i, emotion in enumerate(emotions):
-        values_trend = [e['emotions'].get(emotion, 0.0) for e in emotion_history]
-        # Apply Gaussian smoothing for better visualization
-        smoothed = gaussian_filter1d(values_trend, sigma=1.5)
-        color = colors[i % len(colors)]  # Use modulo to prevent index out of range
-        ax.plot(smoothed, label=emotion, color=color, linewidth=2.5, marker='o', markersize=4)
-
-    ax.set_title("Emotion Trends Throughout the Call", fontsize=16, fontweight='bold', color='#1f2937', pad=20)
-    ax.set_xlabel("Time Segments", fontsize=12, color='#6b7280')
-    ax.set_ylabel("Emotion Intensity", fontsize=12, color='#6b7280')
-    
-    # Enhanced legend
-    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left', frameon=False, fontsize=10)
-    
-    # Enhanced styling
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_color('#e5e7eb')
-    ax.spines['bottom'].set_color('#e5e7eb')
-    ax.grid(True, linestyle='-', alpha=0.1)
-    ax.tick_params(colors='#6b7280', labelsize=10)
-    
-    line_fig.tight_layout()
-
-    return f"✅ Analysis completed successfully!\n{timing_info}", fig_to_image(bar_fig), fig_to_image(line_fig), full_transcript
-
-
-def process_batch(audio_files):
-    """Process multiple audio files in batch"""
-    if not audio_files:
-        return "❌ No files uploaded", [], [], "No transcriptions available.", "❌ Please upload audio files first."
-    
+log.info("Device set to use %s", device)
+
+# Professional color palette, cycled if there are more emotions than colors.
+# The labels are fixed, so the emotion -> color map is built once rather than per chart.
+CHART_COLORS = ['#6366f1', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981', '#ef4444', '#06b6d4', '#84cc16']
+EMOTION_COLORS = {emotion: CHART_COLORS[i % len(CHART_COLORS)] for i, emotion in enumerate(LABEL_ORDER)}
+
+class MemoryCache:
+    """Bounded in-process LRU with the get/set subset of the diskcache.Cache API used here."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, deadline = entry
+            if deadline is not None and deadline < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expire=None):
+        with self._lock:
+            deadline = time.monotonic() + expire if expire is not None else None
+            self._entries[key] = (value, deadline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Finished analyses keyed by (content hash, model version, result format) hold full transcripts,
+# so by default they only live in memory. Set ANALYSIS_DISK_CACHE=1 to persist them across restarts.
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_TTL = 24 * 60 * 60  # seconds
+USE_DISK_CACHE = os.environ.get("ANALYSIS_DISK_CACHE") == "1"
+if USE_DISK_CACHE:
+    import diskcache
+    analysis_cache = diskcache.Cache(
+        os.path.join(APP_DIR, "cache"),
+        size_limit=2 << 30,
+        disk_pickle_protocol=pickle.HIGHEST_PROTOCOL
+    )
+    STORAGE_NOTE = "Results are cached on this server for up to 24 hours so repeat uploads return instantly."
+else:
+    analysis_cache = MemoryCache(max_entries=32)
+    STORAGE_NOTE = "Results are kept in memory for up to 24 hours to speed up repeat uploads; nothing is written to disk."
+
+def file_digest(path):
+    """Hash the file contents in chunks so large recordings aren't read into memory at once."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Bump whenever run_live_analysis changes what it returns, so stale cache entries are ignored
+RESULT_FORMAT = 2
+
+def format_batch_results(files_to_process, keys, results):
+    """Combine the finished files, in upload order, into the status, chart and transcript outputs"""
     statuses = []
-    bars = []
-    lines = []
+    charts = []
     transcripts = []
     
-    # Process up to 10 files
-    files_to_process = audio_files[:10] if len(audio_files) > 10 else audio_files
-    
-    for i, file in enumerate(files_to_process):
-        print(f"Processing file {i+1}/{len(files_to_process)}: {file}")
-        status, bar_fig, line_fig, transcript = run_live_analysis(file)
-        
+    for i, (file, key) in enumerate(zip(files_to_process, keys)):
+        if key not in results:
+            continue
+        status, bar_df, line_df, transcript = results[key]
         # Format status with file info
         file_name = os.path.basename(file) if file else f"File {i+1}"
         formatted_status = f"📁 {file_name}\n{status}\n" + "="*50
         
         statuses.append(formatted_status)
-        if bar_fig:
-            bars.append(bar_fig)
-        if line_fig:
-            lines.append(line_fig)
+        if bar_df is not None:
+            charts.append((file_name, bar_df, line_df))
         
         # Format transcript with file info
         formatted_transcript = f"📁 {file_name}:\n{transcript}\n" + "="*80 + "\n"
         transcripts.append(formatted_transcript)
     
     # Combine all results
-    combined_status = "\n".join(statuses)
-    combined_transcripts = "\n".join(transcripts)
+    return "\n".join(statuses), charts, "\n".join(transcripts)
+
+
+def process_batch(audio_files):
+    """Process multiple audio files in batch, streaming each file's results as soon as it finishes"""
+    if not audio_files:
+        yield "❌ No files uploaded", [], "No transcriptions available.", "❌ Please upload audio files first."
+        return
+    
+    # Process up to 10 files
+    files_to_process = audio_files[:MAX_BATCH_FILES]
+    
+    # Key each file by content so repeat uploads (in this batch or earlier ones) are analyzed once
+    keys = [(file_digest(file), ANALYSIS_VERSION, RESULT_FORMAT) for file in files_to_process]
+    results = {}
+    pending = {}
+    for file, key in zip(files_to_process, keys):
+        if key in results or key in pending:
+            continue
+        cached = analysis_cache.get(key)
+        if cached is not None:
+            results[key] = cached
+        else:
+            pending[key] = file
+    log.info("Processing %d file(s): %d cached, %d to analyze", len(files_to_process), len(results), len(pending))
+
+    if pending:
+        # Show cached files right away while the rest are analyzed
+        done = sum(key in results for key in keys)
+        yield *format_batch_results(files_to_process, keys, results), f"⏳ {done}/{len(files_to_process)} file(s) ready..."
+
+        for key, result in analyze_files(pending):
+            results[key] = result
+            # Only successful analyses are worth keeping
+            if result[1] is not None:
+                analysis_cache.set(key, result, expire=CACHE_TTL)
+
+            done = sum(key in results for key in keys)
+            yield *format_batch_results(files_to_process, keys, results), f"⏳ {done}/{len(files_to_process)} file(s) ready..."
     
     notification = f"✅ Successfully processed {len(files_to_process)} file(s)!"
-    if len(audio_files) > 10:
-        notification += f" (Limited to first 10 files, {len(audio_files) - 10} files skipped)"
+    if len(audio_files) > MAX_BATCH_FILES:
+        notification += f" (Limited to first {MAX_BATCH_FILES} files, {len(audio_files) - MAX_BATCH_FILES} files skipped)"
     
-    return combined_status, bars, lines, combined_transcripts, notification
+    yield *format_batch_results(files_to_process, keys, results), notification
 
 # Enhanced Custom CSS for professional look
 custom_css = """
@@ -488,27 +477,35 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(), title="AI Call Emotion An
                 )
     
     # Results Display Section
-    with gr.Row():
-        with gr.Column():
-            # Gallery for bar charts
-            bar_fig_out = gr.Gallery(
-                label="📈 Emotion Distribution Charts",
-                show_label=True,
-                columns=2,
-                rows=2,
-                height="auto"
-            )
-    
-    with gr.Row():
-        with gr.Column():
-            # Gallery for line charts  
-            line_fig_out = gr.Gallery(
-                label="📉 Emotion Timeline Charts", 
-                show_label=True,
-                columns=2,
-                rows=2,
-                height="auto"
-            )
+    # (file name, bar DataFrame, line DataFrame) for every analyzed file
+    charts_state = gr.State([])
+
+    @gr.render(inputs=charts_state)
+    def render_charts(charts):
+        for file_name, bar_df, line_df in charts:
+            with gr.Row():
+                with gr.Column():
+                    gr.BarPlot(
+                        bar_df,
+                        x='emotion',
+                        y='pct',
+                        color='emotion',
+                        color_map=EMOTION_COLORS,
+                        title=f"📈 Emotion Distribution - {file_name}",
+                        x_title="Emotion",
+                        y_title="Percentage (%)"
+                    )
+                with gr.Column():
+                    gr.LinePlot(
+                        line_df,
+                        x='t',
+                        y='value',
+                        color='emotion',
+                        color_map=EMOTION_COLORS,
+                        title=f"📉 Emotion Trends - {file_name}",
+                        x_title="Time Segments",
+                        y_title="Emotion Intensity"
+                    )
     
     # Transcription Section
     with gr.Row():
@@ -523,7 +520,7 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(), title="AI Call Emotion An
     
     # Features Section
     with gr.Row():
-        gr.HTML("""
+        gr.HTML(f"""
             <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 1.5rem; margin-top: 2rem;">
                 <div class="feature-card">
                     <div class="feature-icon">🎯</div>
@@ -550,7 +547,7 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(), title="AI Call Emotion An
                     <div class="feature-icon">🔒</div>
                     <h3 style="margin: 0 0 0.5rem 0; color: var(--text-primary);">Secure Processing</h3>
                     <p style="margin: 0; color: var(--text-secondary); font-size: 0.875rem;">
-                        All files processed securely with no permanent storage of sensitive data.
+                        {STORAGE_NOTE}
                     </p>
                 </div>
             </div>
@@ -560,7 +557,7 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft(), title="AI Call Emotion An
     analyze_btn.click(
         process_batch, 
         inputs=audio_input, 
-        outputs=[status_out, bar_fig_out, line_fig_out, transcript_out, notification_out],
+        outputs=[status_out, charts_state, transcript_out, notification_out],
         show_progress=True
     )
 
@@ -0,0 +1,174 @@
+"""Batch analysis workers. Kept free of UI code so pool processes only import the models."""
+import concurrent.futures
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import torch
+from scipy.ndimage import gaussian_filter1d
+from emotion_agent import COMPILE_EMOTION_MODEL, analyze_call, classify_emotion, get_emotion_model, get_transcriber
+
+log = logging.getLogger(__name__)
+
+# Upper bound on files per batch
+MAX_BATCH_FILES = 10
+
+# Every pool worker holds its own copy of Whisper and DistilBERT, so the default pool is small.
+# ANALYSIS_WORKERS raises it on machines with the RAM and cores to spare.
+DEFAULT_WORKERS = 2
+# A worker stuck on a single thread is slower than running the file in-process, so never go below this
+MIN_THREADS_PER_WORKER = 2
+
+FAILED_RESULT = ("❌ Analysis failed - Please try again with a valid audio file", None, None, "No transcription available.")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def available_cpus():
+    """CPUs this process can actually use: the affinity mask, capped by a cgroup v2 CPU quota if one is set."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def pool_size():
+    """Return (workers, threads per worker) for the batch pool."""
+    cpus = available_cpus()
+    requested = int(os.environ.get("ANALYSIS_WORKERS", DEFAULT_WORKERS))
+    workers = max(1, min(requested, MAX_BATCH_FILES, cpus // MIN_THREADS_PER_WORKER))
+    return workers, max(MIN_THREADS_PER_WORKER, cpus // workers)
+
+def get_executor():
+    """Return the shared process pool, starting it on first use.
+
+    Workers live as long as the app, so the models are loaded once per worker rather than per batch.
+    They are started from a clean forkserver (or spawn) process rather than forked from the app, so
+    they never inherit models or thread pools the app process loaded for single-file batches, and
+    they start on demand instead of all at once.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers, threads = pool_size()
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=init_worker,
+                initargs=(threads,)
+            )
+        return _executor
+
+def reset_executor(executor):
+    """Drop a broken pool (e.g. a worker was killed) so the next batch starts a fresh one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def init_worker(num_threads):
+    """Prepare a batch worker: split the cores and warm the model caches."""
+    torch.set_num_threads(num_threads)
+    get_transcriber()
+    get_emotion_model()
+    if COMPILE_EMOTION_MODEL:
+        # Trace once here so the first file doesn't pay for compilation
+        classify_emotion("Warming up the emotion model.")
+
+@lru_cache(maxsize=1)
+def _prepare_in_process():
+    """Give single-file batches in the app process every available core."""
+    torch.set_num_threads(available_cpus())
+
+def analyze_files(files):
+    """Yield (key, result) for each {key: audio path} entry as soon as it finishes.
+
+    A lone file runs in this process with all available threads; a pool worker only gets its share.
+    """
+    if len(files) == 1:
+        _prepare_in_process()
+        for key, file in files.items():
+            yield key, run_live_analysis(file)
+        return
+
+    executor, futures = _submit_all(files)
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); fail this file and start a fresh pool next batch
+            reset_executor(executor)
+            result = FAILED_RESULT
+        yield futures[future], result
+
+def _submit_all(files):
+    """Submit every file to the shared pool, replacing the pool once if it is already broken."""
+    executor = get_executor()
+    try:
+        return executor, {executor.submit(run_live_analysis, file): key for key, file in files.items()}
+    except BrokenProcessPool:
+        # A worker died while nobody was waiting on its futures (e.g. the client disconnected
+        # mid-batch), so the failure was never seen by as_completed; start over with a fresh pool
+        reset_executor(executor)
+        executor = get_executor()
+        return executor, {executor.submit(run_live_analysis, file): key for key, file in files.items()}
+
+def run_live_analysis(audio_file):
+    """Analyze one file; failures come back as FAILED_RESULT so they only affect their own row."""
+    try:
+        return _analyze_file(audio_file)
+    except Exception:
+        # Exceptions such as ffmpeg.Error can't be unpickled in the parent, which would break the
+        # pool for every other file in the batch, so they're reported here instead of raised
+        log.exception("Analysis failed for %s", audio_file)
+        return FAILED_RESULT
+
+def _analyze_file(audio_file):
+    log.info("🎧 Starting analysis...")
+    result = analyze_call(audio_file)
+
+    if result is None or len(result) != 3:
+        return FAILED_RESULT
+
+    emotion_history, final_percentages, full_transcript = result
+
+    # Timing Analysis
+    total_segments = len(emotion_history["texts"])
+    segment_duration = 30  # seconds
+    total_duration = total_segments * segment_duration
+    timing_info = f"📊 Analysis completed in {total_segments} segments over {total_duration//60}m {total_duration%60}s"
+
+    # Chart data goes to the browser as DataFrames; Gradio renders the plots client-side
+    emotions = list(final_percentages.keys())
+    values = list(final_percentages.values())
+    bar_df = pd.DataFrame({'emotion': emotions, 'pct': values})
+
+    # Emotion trends as a [T, num_emotions] matrix, one column per charted emotion
+    label_idx = [emotion_history["labels"].index(emotion) for emotion in emotions]
+    trend_matrix = emotion_history["scores"][:, label_idx]
+    # Gaussian smoothing is linear, so build the operator once and apply it to every emotion with one matmul
+    if total_segments:
+        smoothing_kernel = gaussian_filter1d(np.eye(total_segments), sigma=1.5, axis=1)
+        smoothed_trends = smoothing_kernel.T @ trend_matrix
+    else:
+        smoothed_trends = trend_matrix
+
+    # Long form, one row per (segment, emotion), in the same order as smoothed_trends.ravel()
+    line_df = pd.DataFrame({
+        't': np.repeat(np.arange(total_segments), len(emotions)),
+        'emotion': np.tile(emotions, total_segments),
+        'value': smoothed_trends.ravel()
+    })
+
+    return f"✅ Analysis completed successfully!\n{timing_info}", bar_df, line_df, full_transcript
@@ -0,0 +1,32 @@
+import os
+import time
+from emotion_agent import COMPILE_EMOTION_MODEL, EMOTION_BATCH_SIZE, get_emotion_model
+
+# Times the emotion classifier on a batch of call-like segments.
+# Run once as-is and once with EMOTION_MODEL_COMPILE=1 to compare eager int8 against torch.compile.
+# Set TORCH_LOGS=graph_breaks to see where Dynamo splits the compiled graph.
+SAMPLE_TEXTS = [
+    "Hi, I'm calling about my last bill.",
+    "I was charged twice for the same order and nobody has called me back.",
+    "Okay.",
+    "Honestly I'm really disappointed, this is the third time I've had to explain the problem.",
+    "Thanks, that actually helps a lot, I appreciate you sorting it out so quickly.",
+    "Wait, so the refund goes to the original card or do I get store credit?",
+]
+texts = SAMPLE_TEXTS * 8
+runs = int(os.environ.get("BENCH_RUNS", 5))
+
+start = time.perf_counter()
+emotion_model = get_emotion_model()
+emotion_model(texts, batch_size=EMOTION_BATCH_SIZE, truncation=True)
+first = time.perf_counter() - start
+
+timings = []
+for _ in range(runs):
+    start = time.perf_counter()
+    emotion_model(texts, batch_size=EMOTION_BATCH_SIZE, truncation=True)
+    timings.append(time.perf_counter() - start)
+
+print(f"compile={COMPILE_EMOTION_MODEL} segments={len(texts)}")
+print(f"load + first batch: {first:.2f}s")
+print(f"steady state: best {min(timings) * 1000:.1f} ms, mean {sum(timings) / len(timings) * 1000:.1f} ms over {runs} runs")
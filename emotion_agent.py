@@ -1,100 +1,214 @@
-from transformers import pipeline
-from collections import defaultdict
-import whisper
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer, pipeline
+from functools import lru_cache
+from numba import njit
+import numpy as np
+import soundfile as sf
+from faster_whisper import WhisperModel
 import ffmpeg
-
-# Load Whisper locally
-transcriber = whisper.load_model("tiny")
-
-# Load emotion classifier
-emotion_model = pipeline(
-    "text-classification", 
-    model="bhadresh-savani/distilbert-base-uncased-emotion", 
-    top_k=None
-)
+import torch
+import torchaudio
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+# Emotion classifier saved by roughmodel.py, loaded from disk instead of the HF hub
+LOCAL_EMOTION_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_emotion_model")
+HUB_EMOTION_MODEL = "bhadresh-savani/distilbert-base-uncased-emotion"
+
+def _emotion_model_source():
+    """Use the local copy only if its weights are real; without `git lfs pull` they are a pointer file."""
+    try:
+        with open(os.path.join(LOCAL_EMOTION_MODEL, "model.safetensors"), 'rb') as f:
+            if not f.read(64).startswith(b"version https://git-lfs"):
+                return LOCAL_EMOTION_MODEL
+    except OSError:
+        pass
+    log.warning("Local emotion model weights missing (run `git lfs pull`); loading %s from the hub", HUB_EMOTION_MODEL)
+    return HUB_EMOTION_MODEL
+
+EMOTION_MODEL_SOURCE = _emotion_model_source()
+
+# Whisper detects the language of each call by default. Deployments that only ever see one
+# language can pin it (e.g. TRANSCRIBE_LANGUAGE=en) to skip the detection pass.
+TRANSCRIBE_LANGUAGE = os.environ.get("TRANSCRIBE_LANGUAGE") or None
+
+# Bump whenever a model or decoding setting changes so cached analyses are recomputed
+ANALYSIS_VERSION = f"faster-whisper-tiny-int8-{TRANSCRIBE_LANGUAGE or 'auto'}-greedy/distilbert-emotion-int8"
+
+# torch.compile of the quantized classifier is opt-in (EMOTION_MODEL_COMPILE=1): every worker pays the
+# compile at startup, and Dynamo may graph-break on the int8 Linear layers. Compare with benchmark_emotion.py.
+COMPILE_EMOTION_MODEL = os.environ.get("EMOTION_MODEL_COMPILE") == "1"
+
+# Models are loaded on first use and cached for the life of the process
+@lru_cache(maxsize=1)
+def get_transcriber():
+    # CTranslate2 int8 Whisper; share the same thread budget torch was given for this process
+    return WhisperModel("tiny", device="cpu", compute_type="int8", cpu_threads=torch.get_num_threads())
+
+@lru_cache(maxsize=1)
+def get_emotion_model():
+    tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL_SOURCE)
+    model = AutoModelForSequenceClassification.from_pretrained(EMOTION_MODEL_SOURCE).eval()
+    # int8 weights for the Linear layers; inference only, so post-training quantization is enough
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    emotion_pipeline = pipeline(
+        "text-classification",
+        model=model,
+        tokenizer=tokenizer,
+        top_k=None,
+        device=-1
+    )
+    if COMPILE_EMOTION_MODEL:
+        # Compile after quantizing; batch sequence lengths vary, so trace with dynamic shapes
+        emotion_pipeline.model = torch.compile(emotion_pipeline.model, dynamic=True)
+    return emotion_pipeline
 
 # Custom emotion labels
 emotion_labels = ['happy', 'angry', 'frustrated', 'confused', 'sad', 'surprised', 'neutral', 'hopeful', 'bored']
-
-def preprocess_audio(input_path, output_path="cleaned.wav"):
-    (
-        ffmpeg
-        .input(input_path)
-        .output(output_path, ar='16000', ac='1', format='wav', af='dynaudnorm')
-        .run(overwrite_output=True)
-    )
-    return output_path
+# Frozen once so the dicts built at the API boundary just zip against it
+LABEL_ORDER = tuple(emotion_labels)
+EMOTION_BATCH_SIZE = 16
+SAMPLE_RATE = 16000  # Whisper expects 16 kHz mono
+TARGET_IDX = {label: i for i, label in enumerate(LABEL_ORDER)}
+
+# Classifier label -> custom emotion; labels not listed are ignored
+_LABEL_TO_TARGET = {
+    'joy': 'happy',
+    'anger': 'angry',
+    'annoyance': 'angry',
+    'disgust': 'frustrated',
+    'disappointment': 'frustrated',
+    'confusion': 'confused',
+    'realization': 'confused',
+    'sadness': 'sad',
+    'surprise': 'surprised',
+    'neutral': 'neutral',
+    'caring': 'hopeful',
+    'excitement': 'hopeful',
+    'boredom': 'bored',
+}
+
+def _build_label_map(id2label):
+    """Map each classifier label id to its custom emotion index (-1 if ignored)."""
+    label_map = np.full(len(id2label), -1, dtype=np.int32)
+    for i in range(len(id2label)):
+        target = _LABEL_TO_TARGET.get(id2label[i].lower())
+        if target:
+            label_map[i] = TARGET_IDX[target]
+    return label_map
+
+# Built from the committed config.json (a regular file, not LFS), so importing never touches the hub.
+# The hub fallback serves the same checkpoint, so its label ids match.
+_id2label = AutoConfig.from_pretrained(LOCAL_EMOTION_MODEL).id2label
+LABEL2ID = {label.lower(): i for i, label in _id2label.items()}
+LABEL_MAP = _build_label_map(_id2label)
+
+@njit(cache=True, fastmath=True)
+def _accumulate(scores, label_map, out):
+    for i in range(scores.size):
+        j = label_map[i]
+        if j >= 0:
+            out[j] += scores[i]
+
+def preprocess_audio(input_path):
+    """Decode to a mono 16 kHz float32 array for Whisper without touching disk."""
+    try:
+        data, sr = sf.read(input_path, dtype='float32', always_2d=False)
+    except sf.LibsndfileError:
+        # Formats libsndfile can't read (e.g. m4a): let ffmpeg decode straight into a pipe
+        out, _ = (
+            ffmpeg
+            .input(input_path)
+            .output('pipe:', format='f32le', ar=str(SAMPLE_RATE), ac='1')
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        data, sr = np.frombuffer(out, dtype=np.float32), SAMPLE_RATE
+
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if sr != SAMPLE_RATE:
+        data = torchaudio.functional.resample(torch.from_numpy(np.ascontiguousarray(data)), sr, SAMPLE_RATE).numpy()
+
+    # Peak normalization in place of ffmpeg's dynaudnorm
+    data = data * (0.9 / max(np.abs(data).max(initial=0.0), 1e-3))
+    return data.astype(np.float32, copy=False)
 
 # TEMP translation fix
 def translate_text_auto(text, src_lang):
     return text
 
-def classify_emotion(text):
-    result = emotion_model(text)[0]
-    mapped = dict.fromkeys(emotion_labels, 0.0)
+def accumulate_emotion_scores(result, out, scores=None):
+    """Fold one row of classifier scores into `out`, indexed like LABEL_ORDER.
 
+    `scores` is an optional scratch buffer of len(LABEL2ID) reused across calls.
+    """
+    if scores is None:
+        scores = np.empty(len(LABEL2ID), dtype=np.float64)
+    # Scores come back sorted by confidence; put them back in label id order
     for item in result:
-        label = item['label'].lower()
-        score = item['score']
-
-        if label in ['joy']:
-            mapped['happy'] += score
-        elif label in ['anger', 'annoyance']:
-            mapped['angry'] += score
-        elif label in ['disgust', 'disappointment']:
-            mapped['frustrated'] += score
-        elif label in ['confusion', 'realization']:
-            mapped['confused'] += score
-        elif label in ['sadness']:
-            mapped['sad'] += score
-        elif label in ['surprise']:
-            mapped['surprised'] += score
-        elif label in ['neutral']:
-            mapped['neutral'] += score
-        elif label in ['caring', 'excitement']:
-            mapped['hopeful'] += score
-        elif label in ['boredom']:
-            mapped['bored'] += score
-
-    return mapped
-
-def analyze_call(audio_path):
-    # Reset per call
-    emotion_totals = defaultdict(float)
-    utterance_count = 0
-    emotion_history = []
-    full_transcript = []
-
-    print("🎧 Preprocessing & transcribing...")
-    clean_path = preprocess_audio(audio_path)
-    result = transcriber.transcribe(clean_path)
-    lang = result.get("language", "en")
-    print(f"🌐 Detected language: {lang}")
-    print("✅ Transcription complete.")
-
-    for segment in result['segments']:
-        text = segment['text']
-        full_transcript.append(text)
-        print(f"\n🗣️: {text}")
-        translated = translate_text_auto(text, lang)
-        emotions = classify_emotion(translated)
-        print(f"🎭 Emotions: {emotions}")
-
-        for k, v in emotions.items():
-            emotion_totals[k] += v
-        utterance_count += 1
-
-        emotion_history.append({
-            "text": text,
-            "translated": translated,
-            "emotions": emotions
-        })
-
-    total = sum(emotion_totals.values())
-    final_percentages = {k: round((v / total) * 100, 2) if total > 0 else 0.0 for k, v in emotion_totals.items()}
-
-    print("\n📊 Final Emotion Percentages:")
-    print(final_percentages)
+        scores[LABEL2ID[item['label'].lower()]] = item['score']
+
+    _accumulate(scores, LABEL_MAP, out)
+    return out
+
+def classify_emotion(text):
+    mapped = accumulate_emotion_scores(get_emotion_model()(text)[0], np.zeros(len(LABEL_ORDER)))
+    return dict(zip(LABEL_ORDER, mapped.tolist()))
+
+def analyze_call(audio_path, language=TRANSCRIBE_LANGUAGE):
+    log.info("🎧 Preprocessing & transcribing...")
+    audio = preprocess_audio(audio_path)
+    # Greedy decoding without conditioning on earlier text; the silero VAD pass drops silence before Whisper sees it
+    segments, info = get_transcriber().transcribe(
+        audio,
+        language=language,
+        condition_on_previous_text=False,
+        temperature=0.0,
+        no_speech_threshold=0.6,
+        vad_filter=True
+    )
+    lang = info.language or "en"
+    if language:
+        log.info("🌐 Language pinned to: %s", lang)
+    else:
+        log.info("🌐 Detected language: %s (p=%.2f)", lang, info.language_probability)
+
+    # Segments are decoded lazily as the generator is consumed
+    full_transcript = [segment.text for segment in segments]
+    log.info("✅ Transcription complete.")
+
+    translated_texts = [translate_text_auto(text, lang) for text in full_transcript]
+
+    # Classify every segment in one batched forward pass
+    all_scores = get_emotion_model()(translated_texts, batch_size=EMOTION_BATCH_SIZE, truncation=True) if translated_texts else []
+
+    # One row of custom emotion scores per segment
+    history_scores = np.zeros((len(all_scores), len(LABEL_ORDER)))
+    scratch = np.empty(len(LABEL2ID), dtype=np.float64)
+    for i, scores in enumerate(all_scores):
+        accumulate_emotion_scores(scores, history_scores[i], scratch)
+
+    # Struct-of-arrays history: segment i is texts[i] with scores[i], columns ordered like labels
+    emotion_history = {
+        "texts": full_transcript,
+        "translated": translated_texts,
+        "scores": history_scores,
+        "labels": LABEL_ORDER
+    }
+
+    # Per-segment detail is debug only, so the dicts aren't built unless someone is listening
+    if log.isEnabledFor(logging.DEBUG):
+        for text, row in zip(full_transcript, history_scores):
+            log.debug("🗣️: %s", text)
+            log.debug("🎭 Emotions: %s", dict(zip(LABEL_ORDER, row.tolist())))
+
+    totals = history_scores.sum(axis=0)
+    total = totals.sum()
+    percentages = (totals * (100.0 / total)).round(2) if total > 0 else totals
+    final_percentages = dict(zip(LABEL_ORDER, percentages.tolist()))
+
+    log.info("📊 Final Emotion Percentages: %s", final_percentages)
 
     transcript_string = "\n".join(full_transcript)
 
@@ -1,4 +1,6 @@
+import logging
 from emotion_agent import analyze_call
 
-analyze_call("recording_chinu.opus")  # your actual file path
+logging.basicConfig(level=logging.INFO)
 
+analyze_call("recording_chinu.opus")  # your actual file path